@@ -4,25 +4,65 @@ Installation script for Smart Shower OS
 Sets up the system with all dependencies and configuration
 """
 
+import collections
+import fcntl
+import hashlib
+import importlib.util
 import os
+import socket
 import sys
 import subprocess
 import shutil
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Serializes status output so concurrent commands don't interleave lines
+print_lock = threading.Lock()
 
-def run_command(command, description):
-    """Run a command and handle errors"""
-    print(f"🔄 {description}...")
+
+def flush_status():
+    """Flush buffered status output at a phase boundary"""
+    sys.stdout.flush()
+
+
+def run_command(command, description, env=None):
+    """Run a command (shell string or argv list) and handle errors"""
+    with print_lock:
+        print(f"🔄 {description}...")
+
+    # Stream output as it arrives instead of buffering it all — pip and
+    # apt can be chatty, and live output doubles as a progress indicator.
+    # Keep only the last 200 lines around for error reporting.
+    tail = collections.deque(maxlen=200)
     try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-        print(f"✅ {description} completed successfully")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {description} failed: {e}")
-        print(f"Error output: {e.stderr}")
+        # Only strings need a shell; argv lists exec the binary directly
+        process = subprocess.Popen(command, shell=isinstance(command, str),
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   bufsize=1, text=True, env=env)
+        for line in process.stdout:
+            tail.append(line)
+            with print_lock:
+                sys.stdout.write(line)
+        returncode = process.wait()
+    except OSError as e:
+        with print_lock:
+            print(f"❌ {description} failed: {e}")
+            flush_status()
         return False
 
+    if returncode != 0:
+        with print_lock:
+            print(f"❌ {description} failed with exit code {returncode}")
+            print(f"Last output:\n{''.join(tail)}")
+            flush_status()
+        return False
+
+    with print_lock:
+        print(f"✅ {description} completed successfully")
+    return True
+
 
 def check_python_version():
     """Check if Python version is compatible"""
@@ -34,15 +74,116 @@ def check_python_version():
     return True
 
 
+def preflight():
+    """Check install prerequisites up front, in parallel"""
+    print("\n🩺 Running preflight checks...")
+
+    def check_sudo():
+        # Probe with which() first: spawning a missing sudo raises
+        # OSError, which would escape executor.map as a raw traceback
+        if shutil.which("sudo") is None:
+            return "sudo is not installed"
+        if os.geteuid() == 0:
+            # Already root — no password to worry about
+            return None
+        ok = subprocess.run(["sudo", "-n", "true"], capture_output=True).returncode == 0
+        return None if ok else "sudo requires a password (run 'sudo -v' first)"
+
+    def check_network():
+        try:
+            socket.create_connection(("archive.ubuntu.com", 80), timeout=3).close()
+            return None
+        except OSError as e:
+            return f"cannot reach the apt mirror: {e}"
+
+    def check_disk_space():
+        free = shutil.disk_usage(".").free
+        if free < 2 * 1024 ** 3:
+            return f"less than 2 GB free ({free // 1024 ** 2} MB) — venv and packages won't fit"
+        return None
+
+    def check_dpkg_lock():
+        lock_path = "/var/lib/dpkg/lock-frontend"
+        if not os.path.exists(lock_path):
+            return None
+        try:
+            fd = os.open(lock_path, os.O_RDWR)
+        except PermissionError:
+            # Can't probe the lock without root; apt will report it
+            return None
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+            return None
+        except OSError:
+            return "another package manager is holding the dpkg lock"
+        finally:
+            os.close(fd)
+
+    # Probe everything concurrently so failures surface in seconds
+    # instead of minutes into a partial install
+    checks = [check_sudo, check_network, check_disk_space, check_dpkg_lock]
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        problems = [problem for problem in executor.map(lambda check: check(), checks) if problem]
+
+    if problems:
+        print("❌ Preflight checks failed:")
+        for problem in problems:
+            print(f"   - {problem}")
+        return False
+
+    print("✅ All preflight checks passed")
+    return True
+
+
+# Packages whose presence is visible as a binary on PATH — base images
+# like Raspberry Pi OS preinstall most of these, and shutil.which is far
+# cheaper than a dpkg lookup
+PACKAGE_COMMANDS = {
+    "python3-pip": "pip3",
+    "ffmpeg": "ffmpeg",
+    "mpv": "mpv",
+    "bluez": "bluetoothctl",
+    "pulseaudio": "pulseaudio",
+    "git": "git",
+    "curl": "curl",
+    "wget": "wget",
+}
+
+
+def get_missing_packages(packages):
+    """Return the packages not yet installed, using one dpkg-query call"""
+    # Cheap PATH lookups first; library-only packages with no binary
+    # fall through to the dpkg query below
+    packages = [package for package in packages
+                if not (PACKAGE_COMMANDS.get(package)
+                        and shutil.which(PACKAGE_COMMANDS[package]))]
+    if not packages:
+        return []
+
+    try:
+        result = subprocess.run(
+            ["dpkg-query", "-W", "-f=${Package} ${Status}\n"] + packages,
+            capture_output=True, text=True)
+    except FileNotFoundError:
+        # No dpkg on this system — let apt sort it out
+        return packages
+
+    installed = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) >= 4 and parts[-1] == "installed":
+            installed.add(parts[0])
+
+    return [package for package in packages if package not in installed]
+
+
 def install_system_dependencies():
     """Install system dependencies"""
     print("\n📦 Installing system dependencies...")
-    
-    # Update package list
-    if not run_command("sudo apt update", "Updating package list"):
-        return False
-    
-    # Install system packages
+
+    # Install system packages (package list is updated earlier, in
+    # parallel with virtual environment creation)
     packages = [
         "python3-pip",
         "python3-venv",
@@ -57,10 +198,22 @@ def install_system_dependencies():
         "wget"
     ]
     
-    for package in packages:
-        if not run_command(f"sudo apt install -y {package}", f"Installing {package}"):
-            return False
-    
+    # Skip packages that are already installed so re-runs don't pay for
+    # a no-op apt transaction
+    packages = get_missing_packages(packages)
+    if not packages:
+        print("✅ All system packages already installed")
+        return True
+
+    # Install everything in one apt transaction instead of one per
+    # package. apt-get is the stable scripting interface; skipping
+    # recommends and the pty/progress-bar machinery keeps the
+    # transaction lean on the Pi's slow I/O
+    command = ["sudo", "apt-get", "install", "-y", "--no-install-recommends",
+               "-o", "Dpkg::Use-Pty=0"] + packages
+    if not run_command(command, "Installing system packages"):
+        return False
+
     return True
 
 
@@ -68,35 +221,98 @@ def create_virtual_environment():
     """Create Python virtual environment"""
     print("\n🔧 Setting up Python virtual environment...")
     
+    # A bare exists() check passes for a half-created venv from an
+    # interrupted run, which then breaks pip minutes later — probe pip
+    # through the interpreter before trusting the venv, since a venv
+    # interrupted between interpreter creation and ensurepip has a
+    # working bin/python but no pip
     venv_path = Path("venv")
-    if venv_path.exists():
-        print("✅ Virtual environment already exists")
-        return True
-    
-    if not run_command("python3 -m venv venv", "Creating virtual environment"):
+    venv_python = venv_path / "bin/python"
+    if venv_python.exists():
+        result = subprocess.run([str(venv_python), "-m", "pip", "--version"], capture_output=True)
+        if result.returncode == 0:
+            print("✅ Virtual environment already exists")
+            return True
+        print("⚠️ Existing virtual environment is broken, recreating it")
+
+    shutil.rmtree(venv_path, ignore_errors=True)
+
+    if not run_command([sys.executable, "-m", "venv", "venv"], "Creating virtual environment"):
         return False
-    
+
     return True
 
 
 def install_python_dependencies():
     """Install Python dependencies"""
     print("\n🐍 Installing Python dependencies...")
-    
-    # Activate virtual environment and install requirements
-    if not run_command("source venv/bin/activate && pip install --upgrade pip", "Upgrading pip"):
+
+    # A pre-resolved lockfile (uv pip compile requirements.txt -o
+    # requirements.lock) lets the installer skip dependency resolution
+    # entirely: uv syncs it in parallel, and pip can install it --no-deps
+    have_lock = Path("requirements.lock").exists()
+    requirements = "requirements.lock" if have_lock else "requirements.txt"
+
+    # Skip the whole install if the venv already matches the requirements
+    requirements_hash = hashlib.sha256(Path(requirements).read_bytes()).hexdigest()
+    stamp = Path("venv/.req.sha256")
+    if stamp.exists() and stamp.read_text().strip() == requirements_hash:
+        print("✅ Python dependencies already up to date")
+        return True
+
+    # Persistent wheel cache so a fresh venv (or container) reuses
+    # previously downloaded/built wheels instead of refetching them
+    env = dict(os.environ, PIP_CACHE_DIR=str(Path.home() / ".cache/smart-shower-pip"))
+
+    if not _install_requirements(have_lock, env):
         return False
-    
-    if not run_command("source venv/bin/activate && pip install -r requirements.txt", "Installing requirements"):
+
+    # Record what was installed so re-runs can short-circuit
+    stamp.write_text(requirements_hash)
+    return True
+
+
+def _install_requirements(have_lock, env):
+    """Install the requirements with uv, falling back to pip"""
+    # Invoke the venv's binaries directly — no need to source activate
+    # through a shell, the venv interpreter resolves its own packages
+
+    # Prefer uv: it resolves and installs packages in parallel, which is
+    # much faster than pip on the large requirements list. uv finds its
+    # target environment via $VIRTUAL_ENV — the venv is never activated,
+    # so point uv at it explicitly
+    uv_env = dict(env, VIRTUAL_ENV=str(Path("venv").resolve()))
+    if run_command(["venv/bin/pip", "install", "uv"], "Bootstrapping uv", env=env):
+        if have_lock:
+            # install --no-deps rather than sync: sync would uninstall
+            # uv itself (it isn't in the lock), forcing a re-bootstrap
+            # on the next cold run
+            if run_command(["venv/bin/uv", "pip", "install", "--no-deps", "-r", "requirements.lock"], "Installing locked requirements", env=uv_env):
+                return True
+        elif run_command(["venv/bin/uv", "pip", "install", "-r", "requirements.txt"], "Installing requirements", env=uv_env):
+            return True
+        print("⚠️ uv install failed, falling back to pip")
+
+    # Fallback: plain pip. Fold the pip self-upgrade into the same
+    # invocation so interpreter startup and resolver setup run once
+    if have_lock:
+        # Everything is pinned, so skip the resolver walk
+        command = ["venv/bin/pip", "install", "--upgrade", "pip", "--no-deps", "-r", "requirements.lock"]
+        description = "Upgrading pip and installing locked requirements"
+    else:
+        command = ["venv/bin/pip", "install", "--upgrade", "pip", "-r", "requirements.txt"]
+        description = "Upgrading pip and installing requirements"
+
+    if not run_command(command, description, env=env):
         return False
-    
+
     return True
 
 
-def create_directories():
+def create_directories(existing):
     """Create necessary directories"""
     print("\n📁 Creating directories...")
-    
+
     directories = [
         "logs",
         "config",
@@ -105,48 +321,70 @@ def create_directories():
         "web/templates",
         "data"
     ]
-    
+
+    # Expand to the full set of directories including parents so web/ is
+    # only handled once for web/static and web/templates, then create
+    # shallowest-first; try/except FileExistsError skips the pre-stat
+    # that exist_ok=True would do
+    all_dirs = set()
     for directory in directories:
         path = Path(directory)
-        path.mkdir(parents=True, exist_ok=True)
-        print(f"✅ Created directory: {directory}")
-    
+        all_dirs.add(path)
+        all_dirs.update(parent for parent in path.parents if str(parent) != ".")
+
+    for path in sorted(all_dirs, key=lambda p: len(p.parts)):
+        name = str(path)
+        # The scandir snapshot already tells us about top-level entries,
+        # so skip the mkdir (and its stat) when the directory is there
+        if name in existing and existing[name].is_dir():
+            print(f"✅ Directory already exists: {name}")
+            continue
+        try:
+            os.mkdir(name)
+            print(f"✅ Created directory: {name}")
+        except FileExistsError:
+            print(f"✅ Directory already exists: {name}")
+
     return True
 
 
 def setup_configuration():
     """Set up configuration files"""
     print("\n⚙️ Setting up configuration...")
-    
-    # Create default configuration files
-    config_dir = Path("config")
-    
+
+    # One directory listing instead of a stat() per config file
+    config_files = set(os.listdir("config"))
+
     # Create settings.yaml if it doesn't exist
-    settings_file = config_dir / "settings.yaml"
-    if not settings_file.exists():
+    if "settings.yaml" not in config_files:
         print("📝 Creating default settings.yaml...")
         # The ConfigManager will create this automatically
-    
+
     # Create credentials.yaml if it doesn't exist
-    credentials_file = config_dir / "credentials.yaml"
-    if not credentials_file.exists():
+    if "credentials.yaml" not in config_files:
         print("📝 Creating default credentials.yaml...")
         # The ConfigManager will create this automatically
-    
+
     return True
 
 
 def setup_bluetooth():
     """Set up Bluetooth configuration"""
     print("\n🔵 Setting up Bluetooth...")
-    
-    # Enable Bluetooth service
-    if not run_command("sudo systemctl enable bluetooth", "Enabling Bluetooth service"):
-        return False
-    
-    if not run_command("sudo systemctl start bluetooth", "Starting Bluetooth service"):
+
+    # Skip the sudo roundtrips when the service is already up
+    enabled = subprocess.run(["systemctl", "is-enabled", "--quiet", "bluetooth"],
+                             capture_output=True).returncode == 0
+    active = subprocess.run(["systemctl", "is-active", "--quiet", "bluetooth"],
+                            capture_output=True).returncode == 0
+    if enabled and active:
+        print("✅ Bluetooth service already enabled and running")
+        return True
+
+    # --now enables and starts in a single systemctl call
+    if not run_command(["sudo", "systemctl", "enable", "--now", "bluetooth"], "Enabling and starting Bluetooth service"):
         return False
-    
+
     return True
 
 
@@ -162,38 +400,57 @@ load-module module-bluetooth-policy
     
     pulse_config_path = Path.home() / ".config/pulse/default.pa"
     pulse_config_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    with open(pulse_config_path, "w") as f:
-        f.write(pulse_config)
-    
+
+    # Write to a temp file and rename into place so an interrupted
+    # install can't leave a half-written default.pa that breaks boot
+    tmp_path = str(pulse_config_path) + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, pulse_config.encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, pulse_config_path)
+
     print("✅ Audio configuration created")
     return True
 
 
-def create_service_file():
-    """Create systemd service file"""
-    print("\n🔧 Creating systemd service...")
-    
-    service_content = """[Unit]
+SERVICE_TEMPLATE = string.Template("""[Unit]
 Description=Smart Shower OS
 After=network.target bluetooth.service
 
 [Service]
 Type=simple
 User=pi
-WorkingDirectory={working_dir}
-Environment=PATH={working_dir}/venv/bin
-ExecStart={working_dir}/venv/bin/python {working_dir}/main.py
+WorkingDirectory=${working_dir}
+Environment=PATH=${working_dir}/venv/bin
+ExecStart=${working_dir}/venv/bin/python ${working_dir}/main.py
 Restart=always
 RestartSec=10
 
 [Install]
 WantedBy=multi-user.target
-""".format(working_dir=os.getcwd())
-    
+""")
+
+
+def create_service_file():
+    """Create systemd service file"""
+    print("\n🔧 Creating systemd service...")
+
+    # Template.substitute rather than str.format so literal {} in future
+    # unit directives don't need escaping
+    service_content = SERVICE_TEMPLATE.substitute(working_dir=os.getcwd())
+
     service_file = Path("/etc/systemd/system/smart-shower.service")
-    
+
     try:
+        # Skip the no-op rewrite: an identical write still churns
+        # systemd's inotify watchers and forces a daemon-reload
+        if service_file.exists() and service_file.read_text() == service_content:
+            print("✅ Systemd service file already up to date")
+            return True
+
         with open(service_file, "w") as f:
             f.write(service_content)
         print("✅ Systemd service file created")
@@ -225,27 +482,39 @@ def setup_permissions():
 def run_tests():
     """Run basic tests"""
     print("\n🧪 Running tests...")
-    
-    # Test Python imports
-    test_script = """
-import sys
-sys.path.append('.')
-
-try:
-    from utils.config_manager import ConfigManager
-    from core.water_control import WaterController
-    from core.audio_manager import AudioManager
-    from core.safety_monitor import SafetyMonitor
-    print("✅ All core modules imported successfully")
-except ImportError as e:
-    print(f"❌ Import error: {e}")
-    sys.exit(1)
-"""
-    
-    if not run_command(f"source venv/bin/activate && python -c \"{test_script}\"", "Testing imports"):
+
+    # Import the core modules in-process instead of spawning the venv's
+    # interpreter — prepending its site-packages lets the checks see the
+    # dependencies installed there, without a cold interpreter start
+    try:
+        venv_site = next(Path("venv/lib").glob("python3.*/site-packages"))
+    except StopIteration:
+        print("❌ Could not locate venv site-packages")
         return False
-    
-    return True
+
+    modules = [
+        "utils.config_manager",
+        "core.water_control",
+        "core.audio_manager",
+        "core.safety_monitor",
+    ]
+
+    original_path = list(sys.path)
+    sys.path.insert(0, str(venv_site))
+    sys.path.insert(0, ".")
+    try:
+        for module in modules:
+            importlib.import_module(module)
+        print("✅ All core modules imported successfully")
+        return True
+    # Not just ImportError: module-level code can raise anything (e.g. a
+    # GPIO library off-Pi), and that must not crash the installer now
+    # that the imports run in-process
+    except Exception as e:
+        print(f"❌ Import error: {e}")
+        return False
+    finally:
+        sys.path[:] = original_path
 
 
 def print_next_steps():
@@ -265,9 +534,17 @@ def print_next_steps():
 
 def main():
     """Main installation function"""
+    # Block-buffer status output: on a serial console (common during Pi
+    # first boot) every print would otherwise be its own write() syscall
+    # and UART flush. flush_status() drains it at phase boundaries.
+    try:
+        sys.stdout.reconfigure(line_buffering=False, write_through=False)
+    except (AttributeError, OSError):
+        pass
+
     print("🚿 Smart Shower OS - Installation Script")
     print("=" * 50)
-    
+
     # Check if running as root
     if os.geteuid() == 0:
         print("⚠️ Warning: Running as root. Consider running as a regular user.")
@@ -275,50 +552,81 @@ def main():
     # Check Python version
     if not check_python_version():
         sys.exit(1)
-    
+
+    # Validate prerequisites before touching apt so a missing password,
+    # dead network, or full disk fails in seconds, not minutes in
+    if not preflight():
+        sys.exit(1)
+    flush_status()
+
+
+    # apt update (network-bound) and venv creation (local disk/CPU) are
+    # independent, so overlap them before the serial install phase. On a
+    # base image without python3-venv (no ensurepip) the concurrent
+    # attempt can't succeed, so don't bother — apt installs the package
+    # below and the venv is created afterwards instead.
+    can_create_venv = importlib.util.find_spec("ensurepip") is not None
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        update_future = executor.submit(run_command, ["sudo", "apt-get", "update"], "Updating package list")
+        venv_future = executor.submit(create_virtual_environment) if can_create_venv else None
+        update_ok = update_future.result()
+        venv_ok = venv_future.result() if venv_future else False
+
+    if not update_ok:
+        print("❌ Failed to update package list")
+        sys.exit(1)
+    flush_status()
+
     # Install system dependencies
     if not install_system_dependencies():
         print("❌ Failed to install system dependencies")
         sys.exit(1)
-    
-    # Create virtual environment
-    if not create_virtual_environment():
+
+    # Retry venv creation now that python3-venv is definitely installed;
+    # any half-created venv from the concurrent attempt gets recreated
+    if not venv_ok and not create_virtual_environment():
         print("❌ Failed to create virtual environment")
         sys.exit(1)
-    
+    flush_status()
+
     # Install Python dependencies
     if not install_python_dependencies():
         print("❌ Failed to install Python dependencies")
         sys.exit(1)
-    
-    # Create directories
-    if not create_directories():
-        print("❌ Failed to create directories")
-        sys.exit(1)
-    
-    # Setup configuration
-    if not setup_configuration():
-        print("❌ Failed to setup configuration")
-        sys.exit(1)
-    
-    # Setup Bluetooth
-    if not setup_bluetooth():
-        print("❌ Failed to setup Bluetooth")
-        sys.exit(1)
-    
-    # Setup audio
-    if not setup_audio():
-        print("❌ Failed to setup audio")
-        sys.exit(1)
-    
-    # Create service file
-    create_service_file()  # Optional, don't fail if this doesn't work
-    
-    # Setup permissions
-    if not setup_permissions():
-        print("❌ Failed to setup permissions")
-        sys.exit(1)
-    
+    flush_status()
+    
+    # Snapshot the working directory once so the setup steps below can
+    # check for entries without issuing a stat() per path
+    existing = {entry.name: entry for entry in os.scandir(".")}
+
+    # The configuration steps touch disjoint resources (systemctl,
+    # pulse config, local dirs, /etc/systemd), so run each tier in
+    # parallel; setup_configuration needs config/ from create_directories
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        tier_one = {
+            "create directories": executor.submit(create_directories, existing),
+            "setup Bluetooth": executor.submit(setup_bluetooth),
+            "setup audio": executor.submit(setup_audio),
+        }
+        failed = [name for name, future in tier_one.items() if not future.result()]
+        if failed:
+            for name in failed:
+                print(f"❌ Failed to {name}")
+            sys.exit(1)
+
+        tier_two = {
+            "setup configuration": executor.submit(setup_configuration),
+            "setup permissions": executor.submit(setup_permissions),
+        }
+        service_future = executor.submit(create_service_file)  # Optional, don't fail
+        failed = [name for name, future in tier_two.items() if not future.result()]
+        service_future.result()
+        if failed:
+            for name in failed:
+                print(f"❌ Failed to {name}")
+            sys.exit(1)
+    flush_status()
+
     # Run tests
     if not run_tests():
         print("❌ Tests failed")
@@ -326,6 +634,7 @@ def main():
     
     # Print next steps
     print_next_steps()
+    flush_status()
 
 
 if __name__ == "__main__":